@@ -90,19 +90,37 @@ cd /path/to/sherpa
   ./icefall-asr-librispeech-pruned-transducer-stateless8-2022-12-02/test_wavs/1221-135766-0002.wav
 """  # noqa
 import argparse
+import functools
+import hashlib
 import logging
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+import kaldifeat
+import numpy as np
 import torch
 import torchaudio
 import sentencepiece as spm
 
+try:
+    import soundfile as sf
+except ImportError:
+    # Fall back to torchaudio.load() for all files
+    sf = None
+
 import sherpa
 from sherpa import str2bool
 
 
 def get_parser():
+    # Note: Each argument needs a field with the same name in AsrArgs below.
+    # Otherwise, AsrArgs(**vars(args)) in main() raises a TypeError.
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -155,6 +173,41 @@ def add_model_args(parser: argparse.ArgumentParser):
         help="Feature dimension of the model",
     )
 
+    parser.add_argument(
+        "--optimize-model",
+        type=str2bool,
+        default=False,
+        help="""True to freeze the encoder, decoder, and joiner of --nn-model
+        with torch.jit.freeze() before decoding. It enables constant folding
+        and operator fusion. If the model cannot be frozen, the original
+        model is used.
+        """,
+    )
+
+    parser.add_argument(
+        "--int8",
+        type=str2bool,
+        default=False,
+        help="""True to quantize the linear layers of --nn-model to int8
+        with dynamic quantization. It requires --optimize-model true and
+        --use-gpu false; it is an error to use it otherwise.
+        """,
+    )
+
+    parser.add_argument(
+        "--model-cache-dir",
+        type=str,
+        default="",
+        help="""Directory to cache models optimized by --optimize-model, so
+        that later runs can load them directly, e.g., ~/.cache/sherpa.
+        Cached models are keyed by the content and modification time of
+        --nn-model, the PyTorch version, --use-gpu, and --int8. Failed
+        optimizations are also recorded so that they are not retried.
+        Old entries are never removed; delete the directory to clean it up.
+        Caching is disabled if it is empty.
+        """,
+    )
+
     parser.add_argument(
         "--use-bbpe",
         type=str2bool,
@@ -174,6 +227,16 @@ def add_decoding_args(parser: argparse.ArgumentParser):
         """,
     )
 
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=16,
+        help="""Maximum number of sound files to decode in a batch. Sound files
+        are sorted by duration before batching so that each batch contains
+        files of similar lengths, which reduces padding in the encoder.
+        """,
+    )
+
     add_modified_beam_search_args(parser)
     add_fast_beam_search_args(parser)
 
@@ -264,6 +327,16 @@ def add_fast_beam_search_args(parser: argparse.ArgumentParser):
         help="Used only when --decoding-method is fast_beam_search",
     )
 
+    parser.add_argument(
+        "--batch-prune",
+        type=str2bool,
+        default=False,
+        help="""Used only when --decoding-method is fast_beam_search.
+        True to remove sound files that have no frames left from the batch
+        during decoding. It does not change the decoding results.
+        """,
+    )
+
     parser.add_argument(
         "--LG",
         type=str,
@@ -309,12 +382,50 @@ def add_resources_args(parser: argparse.ArgumentParser):
         "--num-threads",
         type=int,
         default=1,
-        help="Sets the number of threads used for interop parallelism "
-        "(e.g. in JIT interpreter) on CPU.",
+        help="Sets the number of threads used for intra-op parallelism "
+        "on CPU. Inter-op parallelism always uses 1 thread.",
     )
 
 
-def check_args(args):
+# slots=True is available only in Python >= 3.10
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
+class AsrArgs:
+    """Parsed command-line arguments. See get_parser() for their meanings."""
+
+    nn_model: str
+    tokens: str
+    sample_rate: int
+    feat_dim: int
+    optimize_model: bool
+    int8: bool
+    model_cache_dir: str
+    use_bbpe: bool
+
+    decoding_method: str
+    batch_size: int
+
+    num_active_paths: int
+    bpe_model: str
+    modeling_unit: str
+    contexts: str
+    context_score: float
+    temperature: float
+
+    max_contexts: int
+    max_states: int
+    allow_partial: bool
+    batch_prune: bool
+    LG: str
+    ngram_lm_scale: float
+    beam: float
+
+    use_gpu: bool
+    num_threads: int
+
+    sound_files: List[str]
+
+
+def check_args(args: AsrArgs):
     if not Path(args.nn_model).is_file():
         raise ValueError(f"{args.nn_model} does not exist")
 
@@ -337,6 +448,12 @@ def check_args(args):
                 args.bpe_model
             ).is_file(), f"{args.bpe_model} does not exist"
 
+    assert args.batch_size > 0, args.batch_size
+
+    if args.int8:
+        assert args.optimize_model, "--int8 requires --optimize-model true"
+        assert not args.use_gpu, "--int8 is supported only on CPU"
+
     if args.decoding_method == "modified_beam_search":
         assert args.num_active_paths > 0, args.num_active_paths
         assert args.temperature > 0, args.temperature
@@ -346,9 +463,67 @@ def check_args(args):
             raise ValueError(f"{args.LG} does not exist")
 
     assert len(args.sound_files) > 0, args.sound_files
-    for f in args.sound_files:
-        if not Path(f).is_file():
-            raise ValueError(f"{f} does not exist")
+
+    # Check the files in parallel since each check is a stat() call, which
+    # can be slow on network file systems
+    num_workers = min(len(args.sound_files), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        exists = executor.map(os.path.isfile, args.sound_files)
+        missing = [f for f, ok in zip(args.sound_files, exists) if not ok]
+
+    if missing:
+        raise ValueError(f"{missing} do not exist")
+
+
+# Resamplers keyed by (orig_freq, new_freq). A Resample module computes
+# its filter kernel once at construction, so files sharing a sample rate
+# reuse it instead of rebuilding the kernel for every file.
+_resamplers: Dict[Tuple[int, int], torchaudio.transforms.Resample] = {}
+
+
+def get_resampler(
+    orig_freq: int, new_freq: int
+) -> torchaudio.transforms.Resample:
+    key = (orig_freq, new_freq)
+    resampler = _resamplers.get(key)
+    if resampler is None:
+        resampler = torchaudio.transforms.Resample(
+            orig_freq=orig_freq,
+            new_freq=new_freq,
+        )
+        resampler = _resamplers.setdefault(key, resampler)
+    return resampler
+
+
+def read_first_channel(filename: str) -> Tuple[torch.Tensor, int]:
+    """Read the first channel of a sound file with soundfile.
+
+    Unlike torchaudio.load(), it does not hold all channels of a
+    multi-channel file in memory at the same time.
+
+    Args:
+      filename:
+        Path to the sound file, e.g., a wav or a flac file.
+    Returns:
+      Return a tuple containing:
+        - A 1-D float32 torch tensor containing samples in the range [-1, 1]
+        - The sample rate of the file
+    """
+    with sf.SoundFile(filename) as f:
+        if f.channels == 1:
+            data = f.read(dtype="float32")
+        else:
+            data = np.empty(f.frames, dtype=np.float32)
+            offset = 0
+            for block in f.blocks(
+                blocksize=65536, dtype="float32", always_2d=True
+            ):
+                end = offset + block.shape[0]
+                data[offset:end] = block[:, 0]
+                offset = end
+            data = data[:offset]
+
+        return torch.from_numpy(data), f.samplerate
 
 
 def read_sound_files(
@@ -363,33 +538,67 @@ def read_sound_files(
     Returns:
       Return a list of 1-D float32 torch tensors.
     """
-    ans = []
-    for f in filenames:
-        wave, sample_rate = torchaudio.load(f)
+
+    def load(f: str) -> torch.Tensor:
+        wave = None
+        if sf is not None and Path(f).suffix.lower() in (".wav", ".flac"):
+            try:
+                wave, sample_rate = read_first_channel(f)
+            except RuntimeError as e:
+                # soundfile.LibsndfileError is a subclass of RuntimeError
+                logging.warning(
+                    f"soundfile failed to read {f}: {e}. Use torchaudio instead"
+                )
+
+        if wave is None:
+            wave, sample_rate = torchaudio.load(f)
+            # We use only the first channel
+            wave = wave[0]
+
         if sample_rate != expected_sample_rate:
-            wave = torchaudio.functional.resample(
-                wave,
-                orig_freq=sample_rate,
-                new_freq=expected_sample_rate,
-            )
+            resampler = get_resampler(sample_rate, int(expected_sample_rate))
+            wave = resampler(wave)
+
+        return wave.contiguous()
 
-        # We use only the first channel
-        ans.append(wave[0].contiguous())
+    # torchaudio releases the GIL while decoding, so files are
+    # loaded in parallel
+    num_workers = min(len(filenames), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        ans = list(executor.map(load, filenames))
     return ans
 
 
-def encode_contexts(args, contexts: List[str]) -> List[List[int]]:
+@functools.lru_cache(maxsize=4)
+def load_tokens(filename: str, mtime: float) -> Dict[str, int]:
+    """Load tokens.txt into a dict mapping a token to its ID.
+
+    Args:
+      filename:
+        Path to tokens.txt
+      mtime:
+        Modification time of the file. It is part of the cache key so
+        that the file is re-read once it is changed.
+    Returns:
+      Return a dict mapping a token to its ID.
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        pairs = [line.split() for line in f.read().splitlines() if line.strip()]
+
+    for toks in pairs:
+        assert len(toks) == 2, len(toks)
+
+    tokens = {t: int(i) for t, i in pairs}
+    assert len(tokens) == len(pairs), f"Duplicate tokens in {filename}"
+    return tokens
+
+
+def encode_contexts(args: AsrArgs, contexts: List[str]) -> List[List[int]]:
     sp = None
     if "bpe" in args.modeling_unit:
         sp = spm.SentencePieceProcessor()
         sp.load(args.bpe_model)
-    tokens = {}
-    with open(args.tokens, "r", encoding="utf-8") as f:
-        for line in f:
-            toks = line.strip().split()
-            assert len(toks) == 2, len(toks)
-            assert toks[0] not in tokens, f"Duplicate token: {toks} "
-            tokens[toks[0]] = int(toks[1])
+    tokens = load_tokens(args.tokens, os.path.getmtime(args.tokens))
     return sherpa.encode_contexts(
         modeling_unit=args.modeling_unit,
         contexts=contexts,
@@ -398,13 +607,196 @@ def encode_contexts(args, contexts: List[str]) -> List[List[int]]:
     )
 
 
-def create_recognizer(args) -> sherpa.OfflineRecognizer:
+class FrozenTransducer(torch.nn.Module):
+    """A container for the frozen encoder, decoder, and joiner of a
+    transducer model. It provides the attributes that sherpa looks up in
+    sherpa/csrc/offline-conformer-transducer-model.cc
+    """
+
+    def __init__(
+        self,
+        encoder: torch.jit.ScriptModule,
+        decoder: torch.jit.ScriptModule,
+        joiner: torch.jit.ScriptModule,
+    ):
+        super().__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+        self.joiner = joiner
+
+
+def optimize_nn_model(
+    nn_model: str,
+    filename: str,
+    use_gpu: bool,
+    int8: bool = False,
+) -> str:
+    """Freeze the encoder, decoder, and joiner of a torchscript transducer
+    model and save the result to the given filename.
+
+    Note: We cannot freeze the model as a whole since that would inline
+    the encoder, decoder, and joiner, which sherpa accesses as attributes.
+
+    Args:
+      nn_model:
+        Path to the torchscript model.
+      filename:
+        Path to save the optimized model.
+      use_gpu:
+        True if the model is going to run on GPU.
+      int8:
+        True to quantize linear layers to int8 with dynamic quantization
+        before freezing. Quantized operators are available only on CPU.
+    Returns:
+      Return the path to the model to use, i.e., the given filename on
+      success or nn_model if the model cannot be optimized.
+    """
+    # Freeze the model on the device it will run on, since freezing may
+    # fold the device of the weights into constants
+    device = "cuda:0" if use_gpu else "cpu"
+    model = torch.jit.load(nn_model, map_location=device)
+    model.eval()
+
+    try:
+        encoder = model.encoder
+        decoder = model.decoder
+        joiner = model.joiner
+    except AttributeError:
+        logging.warning(f"{nn_model} is not a transducer model. Skip freezing")
+        return nn_model
+
+    def freeze(m, preserved_attrs: List[str]):
+        m.eval()
+        if int8:
+            # Note: convert_dynamic_jit() also freezes the module.
+            # Preserved submodules, i.e., encoder_proj and decoder_proj of
+            # the joiner, are called directly by sherpa and stay in fp32.
+            qconfig_dict = {"": torch.ao.quantization.default_dynamic_qconfig}
+            m = torch.ao.quantization.prepare_dynamic_jit(m, qconfig_dict)
+            m = torch.ao.quantization.convert_dynamic_jit(
+                m, preserved_attrs=preserved_attrs
+            )
+        else:
+            m = torch.jit.freeze(m, preserved_attrs=preserved_attrs)
+
+        # Note: We don't use torch.jit.optimize_for_inference() here.
+        # On CPU it packs weights into MKLDNN constants, which cannot be
+        # saved by torch.jit.save().
+        return m
+
+    try:
+        model = FrozenTransducer(
+            encoder=freeze(encoder, []),
+            decoder=freeze(decoder, ["context_size"]),
+            joiner=freeze(joiner, ["encoder_proj", "decoder_proj"]),
+        )
+        torch.jit.save(torch.jit.script(model), filename)
+    except RuntimeError as e:
+        logging.warning(f"Failed to freeze {nn_model}: {e}")
+        return nn_model
+
+    return filename
+
+
+def get_model_cache_key(args: AsrArgs) -> str:
+    """Return the key of the optimized model in --model-cache-dir.
+
+    Only the first 1 MB of --nn-model is hashed. Together with the file size
+    and modification time, it is enough to detect a changed model without
+    reading the whole file.
+    """
+    h = hashlib.sha256()
+    with open(args.nn_model, "rb") as f:
+        h.update(f.read(1 << 20))
+
+    stat = os.stat(args.nn_model)
+    h.update(
+        f"{stat.st_size}-{stat.st_mtime_ns}-{torch.__version__}-"
+        f"{args.use_gpu}-{args.int8}".encode()
+    )
+    return h.hexdigest()
+
+
+def get_optimized_nn_model(args: AsrArgs, tmp_dir: str) -> str:
+    """Return the path to the optimized --nn-model.
+
+    The optimized model is saved in tmp_dir. If --model-cache-dir is not
+    empty, the optimized model is loaded from it when available and copied
+    to it otherwise. If the model failed to be optimized before, the original
+    --nn-model is returned without trying again. Errors when accessing the
+    cache are not fatal; the model in tmp_dir is used instead.
+    """
+    filename = None
+    if args.model_cache_dir:
+        try:
+            key = get_model_cache_key(args)
+            cache_dir = Path(args.model_cache_dir).expanduser()
+            filename = cache_dir / f"{key}.pt"
+            if filename.is_file():
+                logging.info(f"Use cached optimized model {filename}")
+                return str(filename)
+
+            if filename.with_suffix(".failed").is_file():
+                logging.info(
+                    f"Failed to optimize {args.nn_model} before. "
+                    "Use it without optimization"
+                )
+                return args.nn_model
+        except (OSError, RuntimeError) as e:
+            # RuntimeError is raised by expanduser() if the home
+            # directory cannot be determined
+            logging.warning(f"Failed to read {args.model_cache_dir}: {e}")
+            filename = None
+
+    nn_model = optimize_nn_model(
+        args.nn_model,
+        filename=f"{tmp_dir}/frozen.pt",
+        use_gpu=args.use_gpu,
+        int8=args.int8,
+    )
+    if filename is None:
+        return nn_model
+
+    if nn_model == args.nn_model:
+        # Record the failure so that later runs do not try again
+        try:
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            filename.with_suffix(".failed").touch()
+        except OSError as e:
+            logging.warning(f"Failed to save {filename}: {e}")
+        return nn_model
+
+    # Copy to a temporary file first and rename it, so that concurrent
+    # runs never see a partially written model
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(nn_model, tmp_filename)
+        os.replace(tmp_filename, filename)
+        logging.info(f"Saved optimized model to {filename}")
+    except OSError as e:
+        logging.warning(f"Failed to save {filename}: {e}")
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+
+    return nn_model
+
+
+def get_feature_config(args: AsrArgs) -> sherpa.FeatureConfig:
     feat_config = sherpa.FeatureConfig()
 
     feat_config.fbank_opts.frame_opts.samp_freq = args.sample_rate
     feat_config.fbank_opts.mel_opts.num_bins = args.feat_dim
     feat_config.fbank_opts.frame_opts.dither = 0
 
+    return feat_config
+
+
+def create_recognizer(args: AsrArgs) -> sherpa.OfflineRecognizer:
+    feat_config = get_feature_config(args)
+
     fast_beam_search_config = sherpa.FastBeamSearchConfig(
         lg=args.LG if args.LG else "",
         ngram_lm_scale=args.ngram_lm_scale,
@@ -412,34 +804,42 @@ def create_recognizer(args) -> sherpa.OfflineRecognizer:
         max_states=args.max_states,
         max_contexts=args.max_contexts,
         allow_partial=args.allow_partial,
+        batch_prune=args.batch_prune,
     )
 
-    config = sherpa.OfflineRecognizerConfig(
-        nn_model=args.nn_model,
-        tokens=args.tokens,
-        use_gpu=args.use_gpu,
-        num_active_paths=args.num_active_paths,
-        context_score=args.context_score,
-        use_bbpe=args.use_bbpe,
-        feat_config=feat_config,
-        decoding_method=args.decoding_method,
-        fast_beam_search_config=fast_beam_search_config,
-        temperature=args.temperature,
-    )
-
-    recognizer = sherpa.OfflineRecognizer(config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nn_model = args.nn_model
+        if args.optimize_model:
+            nn_model = get_optimized_nn_model(args, tmp_dir)
+
+        config = sherpa.OfflineRecognizerConfig(
+            nn_model=nn_model,
+            tokens=args.tokens,
+            use_gpu=args.use_gpu,
+            num_active_paths=args.num_active_paths,
+            context_score=args.context_score,
+            use_bbpe=args.use_bbpe,
+            feat_config=feat_config,
+            decoding_method=args.decoding_method,
+            fast_beam_search_config=fast_beam_search_config,
+            temperature=args.temperature,
+        )
+
+        recognizer = sherpa.OfflineRecognizer(config)
 
     return recognizer
 
 
 def main():
-    args = get_parser().parse_args()
-    logging.info(vars(args))
+    args = AsrArgs(**vars(get_parser().parse_args()))
+    logging.info(asdict(args))
     check_args(args)
 
     torch.set_num_threads(args.num_threads)
-    torch.set_num_interop_threads(args.num_threads)
+    torch.set_num_interop_threads(1)
 
+    # Note: The constructor of sherpa.OfflineRecognizer warms up the model
+    # by running 2 seconds of silence through the encoder
     recognizer = create_recognizer(args)
     sample_rate = args.sample_rate
 
@@ -456,19 +856,72 @@ def main():
         print(f"Contexts list: {contexts}")
         contexts_list = encode_contexts(args, contexts)
 
-    streams: List[sherpa.OfflineStream] = []
-    for s in samples:
-        if contexts_list:
-            stream = recognizer.create_stream(contexts_list=contexts_list)
+    # Sort the waves by length so that waves in the same batch have
+    # similar durations. streams[i] corresponds to args.sound_files[i].
+    lengths = [s.numel() for s in samples]
+    order = sorted(range(len(samples)), key=lambda i: lengths[i])
+
+    # It uses the same options as the feature extractor of the recognizer
+    fbank = kaldifeat.Fbank(get_feature_config(args).fbank_opts)
+
+    # Note: Grad mode is thread local, so we use a decorator here
+    # since this function may run in a worker thread
+    @torch.inference_mode()
+    def create_streams(indexes: List[int]) -> List[sherpa.OfflineStream]:
+        # Compute features of all waves in the batch with a single call
+        # instead of one call per stream
+        features = fbank([samples[i] for i in indexes])
+
+        ans = []
+        for f in features:
+            if contexts_list:
+                stream = recognizer.create_stream(contexts_list=contexts_list)
+            else:
+                stream = recognizer.create_stream()
+            stream.accept_features(f)
+            ans.append(stream)
+        return ans
+
+    batches = []
+    for start in range(0, len(order), args.batch_size):
+        end = start + args.batch_size
+        batches.append(order[start:end])
+
+    streams: List[Optional[sherpa.OfflineStream]] = [None] * len(samples)
+    with torch.inference_mode():
+        if args.use_gpu:
+            # Compute features of the next batch on CPU while the GPU is
+            # decoding the current batch. decode_streams() releases the GIL.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(create_streams, batches[0])
+                for k, indexes in enumerate(batches):
+                    batch_streams = future.result()
+                    if k + 1 < len(batches):
+                        future = executor.submit(create_streams, batches[k + 1])
+
+                    recognizer.decode_streams(batch_streams)
+                    for i, stream in zip(indexes, batch_streams):
+                        streams[i] = stream
         else:
-            stream = recognizer.create_stream()
-        stream.accept_samples(s)
-        streams.append(stream)
+            for indexes in batches:
+                batch_streams = create_streams(indexes)
+                recognizer.decode_streams(batch_streams)
+                for i, stream in zip(indexes, batch_streams):
+                    streams[i] = stream
+
+    # Write all results at once instead of flushing once per file
+    sys.stdout.write(
+        "\n".join(
+            f"{filename}\n{stream.result}"
+            for filename, stream in zip(args.sound_files, streams)
+        )
+        + "\n"
+    )
+    sys.stdout.flush()
 
-    recognizer.decode_streams(streams)
-    for filename, stream in zip(args.sound_files, streams):
-        print(f"{filename}\n{stream.result}")
 
+# We never compute gradients in this file
+torch.set_grad_enabled(False)
 
 # See https://github.com/pytorch/pytorch/issues/38342
 # and https://github.com/pytorch/pytorch/issues/33354
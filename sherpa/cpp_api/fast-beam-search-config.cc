@@ -38,7 +38,8 @@ std::string FastBeamSearchConfig::ToString() const {
   os << "beam=" << beam << ", ";
   os << "max_states=" << max_states << ", ";
   os << "max_contexts=" << max_contexts << ", ";
-  os << "allow_partial=" << (allow_partial ? "True" : "False") << ")";
+  os << "allow_partial=" << (allow_partial ? "True" : "False") << ", ";
+  os << "batch_prune=" << (batch_prune ? "True" : "False") << ")";
 
   return os.str();
 }
@@ -27,6 +27,12 @@ struct FastBeamSearchConfig {
   int32_t max_contexts = 8;
   bool allow_partial = false;
 
+  // Used only in offline decoding.
+  // If true, streams that have consumed all of their frames are removed
+  // from the batch so that the decoder and joiner are not run on padding
+  // frames. It does not change the decoding results.
+  bool batch_prune = false;
+
   void Register(ParseOptions *po);
 
   void Validate() const;
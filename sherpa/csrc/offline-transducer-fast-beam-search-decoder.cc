@@ -3,7 +3,9 @@
 // Copyright (c)  2022  Xiaomi Corporation
 #include "sherpa/csrc/offline-transducer-fast-beam-search-decoder.h"
 
+#include <numeric>
 #include <utility>
+#include <vector>
 
 #include "k2/torch_api.h"
 
@@ -44,10 +46,67 @@ OfflineTransducerFastBeamSearchDecoder::Decode(torch::Tensor encoder_out,
       k2::CreateRnntStreams(stream_vec, vocab_size_, context_size, config_.beam,
                             config_.max_contexts, config_.max_states);
 
+  encoder_out_length = encoder_out_length.cpu().to(torch::kInt);
+  std::vector<int32_t> processed_frames_vec(
+      encoder_out_length.data_ptr<int32_t>(),
+      encoder_out_length.data_ptr<int32_t>() + encoder_out_length.numel());
+
+  // active[i] is the index into stream_vec of the i-th stream in `streams`.
+  // Used only when config_.batch_prune is true.
+  std::vector<int32_t> active(batch_size);
+  std::iota(active.begin(), active.end(), 0);
+
+  // active_encoder_out contains frames [frame_offset, num_frames) of the
+  // active streams
+  torch::Tensor active_encoder_out = encoder_out;
+  int32_t frame_offset = 0;
+
   k2::RaggedShapePtr shape;
   torch::Tensor contexts;
 
   for (int32_t t = 0; t != num_frames; ++t) {
+    if (config_.batch_prune) {
+      // Remove streams that have consumed all of their frames from the batch.
+      // The remaining frames of those streams are padding and are ignored
+      // by k2::FormatOutput() anyway.
+      std::vector<int32_t> still_active;
+      still_active.reserve(active.size());
+      for (int32_t i : active) {
+        if (processed_frames_vec[i] > t) {
+          still_active.push_back(i);
+        }
+      }
+
+      if (still_active.empty()) {
+        break;
+      }
+
+      if (still_active.size() != active.size()) {
+        k2::TerminateAndFlushRnntStreams(streams);
+
+        active = std::move(still_active);
+
+        std::vector<k2::RnntStreamPtr> active_stream_vec;
+        active_stream_vec.reserve(active.size());
+        for (int32_t i : active) {
+          active_stream_vec.push_back(stream_vec[i]);
+        }
+
+        streams = k2::CreateRnntStreams(active_stream_vec, vocab_size_,
+                                        context_size, config_.beam,
+                                        config_.max_contexts,
+                                        config_.max_states);
+
+        // Copy only the frames that are not decoded yet
+        auto active_index =
+            torch::tensor(active, torch::kInt).to(torch::kLong).to(device);
+        active_encoder_out =
+            encoder_out.narrow(/*dim*/ 1, /*start*/ t, num_frames - t)
+                .index_select(/*dim*/ 0, /*index*/ active_index);
+        frame_offset = t;
+      }
+    }
+
     std::tie(shape, contexts) = k2::GetRnntContexts(streams);
     contexts = contexts.to(torch::kLong);
     // contexts.shape: (num_hyps, context_size)
@@ -55,8 +114,9 @@ OfflineTransducerFastBeamSearchDecoder::Decode(torch::Tensor encoder_out,
     auto decoder_out = model_->RunDecoder(contexts).unsqueeze(1);
     // decoder_out.shape: (num_hyps, 1, 1, joiner_dim)
 
-    auto cur_encoder_out = encoder_out.index({torch::indexing::Slice(), t});
-    // cur_encoder_out has shape (N, joiner_dim)
+    auto cur_encoder_out =
+        active_encoder_out.index({torch::indexing::Slice(), t - frame_offset});
+    // cur_encoder_out has shape (num_active_streams, joiner_dim)
 
     auto index = k2::RowIds(shape, 1).to(torch::kLong).to(device);
     cur_encoder_out = cur_encoder_out.index_select(/*dim*/ 0, /*index*/ index);
@@ -77,10 +137,16 @@ OfflineTransducerFastBeamSearchDecoder::Decode(torch::Tensor encoder_out,
 
   k2::TerminateAndFlushRnntStreams(streams);
 
-  encoder_out_length = encoder_out_length.cpu().to(torch::kInt);
-  std::vector<int32_t> processed_frames_vec(
-      encoder_out_length.data_ptr<int32_t>(),
-      encoder_out_length.data_ptr<int32_t>() + encoder_out_length.numel());
+  if (static_cast<int32_t>(active.size()) != batch_size) {
+    // k2::FormatOutput() needs all of the streams. Their decoded frames
+    // have been flushed to each stream above.
+    streams = k2::CreateRnntStreams(stream_vec, vocab_size_, context_size,
+                                    config_.beam, config_.max_contexts,
+                                    config_.max_states);
+
+    // k2::FormatOutput() requires the streams to be detached first
+    k2::TerminateAndFlushRnntStreams(streams);
+  }
 
   auto lattice =
       k2::FormatOutput(streams, processed_frames_vec, config_.allow_partial);
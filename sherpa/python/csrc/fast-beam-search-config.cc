@@ -20,8 +20,8 @@ void PybindFastBeamSearch(py::module &m) {  // NOLINT
   py::class_<PyClass>(m, "FastBeamSearchConfig")
       .def(py::init([](const std::string &lg = "", float ngram_lm_scale = 0.01,
                        float beam = 20.0, int32_t max_states = 64,
-                       int32_t max_contexts = 8,
-                       bool allow_partial =
+                       int32_t max_contexts = 8, bool allow_partial = false,
+                       bool batch_prune =
                            false) -> std::unique_ptr<FastBeamSearchConfig> {
              auto config = std::make_unique<FastBeamSearchConfig>();
 
@@ -31,19 +31,21 @@ void PybindFastBeamSearch(py::module &m) {  // NOLINT
              config->max_states = max_states;
              config->max_contexts = max_contexts;
              config->allow_partial = allow_partial;
+             config->batch_prune = batch_prune;
 
              return config;
            }),
            py::arg("lg") = "", py::arg("ngram_lm_scale") = 0.01,
            py::arg("beam") = 20.0, py::arg("max_states") = 64,
            py::arg("max_contexts") = 8, py::arg("allow_partial") = false,
-           kFastBeamSearchConfigInitDoc)
+           py::arg("batch_prune") = false, kFastBeamSearchConfigInitDoc)
       .def_readwrite("lg", &PyClass::lg)
       .def_readwrite("ngram_lm_scale", &PyClass::ngram_lm_scale)
       .def_readwrite("beam", &PyClass::beam)
       .def_readwrite("max_states", &PyClass::max_states)
       .def_readwrite("max_contexts", &PyClass::max_contexts)
       .def_readwrite("allow_partial", &PyClass::allow_partial)
+      .def_readwrite("batch_prune", &PyClass::batch_prune)
       .def("validate", &PyClass::Validate)
       .def("__str__",
            [](const PyClass &self) -> std::string { return self.ToString(); });
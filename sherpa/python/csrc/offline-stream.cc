@@ -31,6 +31,16 @@ Args:
     by the feature extractor.
 )doc";
 
+static constexpr const char *kOfflineStreamAcceptFeaturesDoc = R"doc(
+Accept features from a 2-D float32 tensor.
+
+Args:
+  features:
+    A 2-D tensor of shape ``(num_frames, feature_dim)``. It should be
+    computed with the same options as the feature extractor of the
+    recognizer, e.g., with ``kaldifeat.Fbank(feat_config.fbank_opts)``.
+)doc";
+
 static void PybindOfflineRecognitionResult(py::module &m) {  // NOLINT
   using PyClass = OfflineRecognitionResult;
   py::class_<PyClass>(m, "OfflineRecognitionResult")
@@ -67,6 +77,17 @@ void PybindOfflineStream(py::module &m) {  // NOLINT
           },
           py::arg("samples"), py::call_guard<py::gil_scoped_release>(),
           kOfflineStreamAcceptSamplesTensorDoc)
+      .def(
+          "accept_features",
+          [](PyClass &self, torch::Tensor features) {
+            TORCH_CHECK(features.dim() == 2,
+                        "Expect a 2-D tensor. Given: ", features.dim());
+            features = features.to(torch::kFloat).contiguous().cpu();
+            self.AcceptFeatures(features.data_ptr<float>(), features.size(0),
+                                features.size(1));
+          },
+          py::arg("features"), py::call_guard<py::gil_scoped_release>(),
+          kOfflineStreamAcceptFeaturesDoc)
       .def_property_readonly("result", &PyClass::GetResult);
 
   // alias
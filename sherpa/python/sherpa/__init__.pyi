@@ -43,6 +43,7 @@ class FastBeamSearchConfig:
         max_states=64,
         max_contexts=8,
         allow_partial=False,
+        batch_prune=False,
     ): ...
 
     lg: str
@@ -51,6 +52,7 @@ class FastBeamSearchConfig:
     max_states: int
     max_contexts: int
     allow_partial: bool
+    batch_prune: bool
 
 @dataclass
 class FeatureConfig:
@@ -155,6 +157,7 @@ class OfflineRecognitionResult:
 class OfflineStream:
     def accept_wave_file(self, filename: str) -> None: ...
     def accept_samples(self, samples: torch.Tensor) -> None: ...
+    def accept_features(self, features: torch.Tensor) -> None: ...
 
     accept_waveform = accept_samples
 
@@ -143,12 +143,24 @@ def encode_contexts(
         # CJK(China Japan Korea) unicode range is [U+4E00, U+9FFF], ref:
         # https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
         pattern = re.compile(r"([\u4e00-\u9fff])")
+        mix_chars_list = []
         for context in contexts:
             # Example:
             #   txt   = "你好 ITS'S OKAY 的"
             #   chars = ["你", "好", " ITS'S OKAY ", "的"]
             chars = pattern.split(context.upper())
-            mix_chars = [w for w in chars if len(w.strip()) > 0]
+            mix_chars_list.append([w for w in chars if len(w.strip()) > 0])
+
+        # Encode all non-CJK segments of all contexts with a single call
+        words = [
+            ch_or_w
+            for mix_chars in mix_chars_list
+            for ch_or_w in mix_chars
+            if pattern.fullmatch(ch_or_w) is None
+        ]
+        pieces_iter = iter(sp.encode(words, out_type=str))
+
+        for mix_chars in mix_chars_list:
             ids = []
             for ch_or_w in mix_chars:
                 # ch_or_w is a single CJK charater(i.e., "你"), do nothing.
@@ -159,9 +171,9 @@ def encode_contexts(
                         else tokens_table["<unk>"]
                     )
                 # ch_or_w contains non-CJK charaters(i.e., " IT'S OKAY "),
-                # encode ch_or_w using bpe_model.
+                # it has been encoded using bpe_model above.
                 else:
-                    for p in sp.encode_as_pieces(ch_or_w):
+                    for p in next(pieces_iter):
                         ids.append(
                             tokens_table[p]
                             if p in tokens_table
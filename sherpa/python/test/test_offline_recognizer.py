@@ -4,12 +4,56 @@
 #
 #  ctest --verbose -R  test_offline_recognizer_py
 
+import importlib.util
+import tempfile
 import unittest
 from pathlib import Path
 
+import kaldifeat
+import torch
+import torchaudio
+
 import sherpa
 
 
+def load_offline_transducer_asr():
+    # sherpa/bin/offline_transducer_asr.py is a script, not a module
+    # of the sherpa package
+    filename = (
+        Path(__file__).resolve().parents[2] / "bin" / "offline_transducer_asr.py"
+    )
+    spec = importlib.util.spec_from_file_location(
+        "offline_transducer_asr", filename
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def word_error_rate(hyp: str, ref: str) -> float:
+    hyp = hyp.split()
+    ref = ref.split()
+
+    # dist[j] is the edit distance between hyp[:i] and ref[:j]
+    dist = list(range(len(ref) + 1))
+    for i in range(1, len(hyp) + 1):
+        prev, dist[0] = dist[0], i
+        for j in range(1, len(ref) + 1):
+            cur = min(
+                dist[j] + 1,
+                dist[j - 1] + 1,
+                prev + (hyp[i - 1] != ref[j - 1]),
+            )
+            prev, dist[j] = dist[j], cur
+
+    return dist[len(ref)] / max(len(ref), 1)
+
+
+# Load it before running any test since importing it sets the number of
+# inter-op threads, which is allowed only before any parallel work starts
+offline_transducer_asr = load_offline_transducer_asr()
+
+
 d = "/tmp/icefall-models"
 # Please refer to
 # https://k2-fsa.github.io/sherpa/cpp/pretrained_models/offline_ctc.html
@@ -309,6 +353,263 @@ class TestOfflineRecognizer(unittest.TestCase):
         print(s1.result)
         print(s2.result)
 
+    def test_icefall_transducer_model_fast_beam_search_batch_prune(self):
+        nn_model = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/exp/cpu_jit.pt"
+        tokens = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/data/lang_bpe_500/tokens.txt"
+        wave1 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1089-134686-0001.wav"
+        wave2 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1221-135766-0001.wav"
+
+        if not Path(nn_model).is_file():
+            print(
+                "skipping test_icefall_transducer_model_fast_beam_search_batch_prune()"
+            )
+            return
+
+        print()
+        print("test_icefall_transducer_model_fast_beam_search_batch_prune()")
+
+        feat_config = sherpa.FeatureConfig()
+
+        feat_config.fbank_opts.frame_opts.samp_freq = 16000
+        feat_config.fbank_opts.mel_opts.num_bins = 80
+        feat_config.fbank_opts.frame_opts.dither = 0
+
+        texts = []
+        for batch_prune in (False, True):
+            fast_beam_search_config = sherpa.FastBeamSearchConfig(
+                beam=4,
+                max_states=64,
+                max_contexts=8,
+                allow_partial=True,
+                batch_prune=batch_prune,
+            )
+
+            config = sherpa.OfflineRecognizerConfig(
+                nn_model=nn_model,
+                tokens=tokens,
+                use_gpu=False,
+                feat_config=feat_config,
+                fast_beam_search_config=fast_beam_search_config,
+                decoding_method="fast_beam_search",
+            )
+
+            recognizer = sherpa.OfflineRecognizer(config)
+
+            # The two waves have different lengths, so batch pruning
+            # removes the shorter one from the batch before the end
+            s1 = recognizer.create_stream()
+            s2 = recognizer.create_stream()
+
+            s1.accept_wave_file(wave1)
+            s2.accept_wave_file(wave2)
+
+            recognizer.decode_streams([s1, s2])
+            print(batch_prune, s1.result)
+            print(batch_prune, s2.result)
+
+            texts.append((s1.result.text, s2.result.text))
+
+        assert texts[0] == texts[1], texts
+
+    def test_icefall_transducer_model_optimize_nn_model(self):
+        nn_model = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/exp/cpu_jit.pt"
+        tokens = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/data/lang_bpe_500/tokens.txt"
+        wave1 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1089-134686-0001.wav"
+        wave2 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1221-135766-0001.wav"
+
+        if not Path(nn_model).is_file():
+            print("skipping test_icefall_transducer_model_optimize_nn_model()")
+            return
+
+        print()
+        print("test_icefall_transducer_model_optimize_nn_model()")
+
+        feat_config = sherpa.FeatureConfig()
+
+        feat_config.fbank_opts.frame_opts.samp_freq = 16000
+        feat_config.fbank_opts.mel_opts.num_bins = 80
+        feat_config.fbank_opts.frame_opts.dither = 0
+
+        def decode(model):
+            config = sherpa.OfflineRecognizerConfig(
+                nn_model=model,
+                tokens=tokens,
+                use_gpu=False,
+                feat_config=feat_config,
+            )
+
+            recognizer = sherpa.OfflineRecognizer(config)
+
+            s1 = recognizer.create_stream()
+            s2 = recognizer.create_stream()
+
+            s1.accept_wave_file(wave1)
+            s2.accept_wave_file(wave2)
+
+            recognizer.decode_streams([s1, s2])
+            print(s1.result)
+            print(s2.result)
+
+            return [s1.result.text, s2.result.text]
+
+        expected = decode(nn_model)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = f"{tmp_dir}/frozen.pt"
+            frozen = offline_transducer_asr.optimize_nn_model(
+                nn_model, filename=filename, use_gpu=False
+            )
+            assert frozen == filename, frozen
+
+            texts = decode(frozen)
+
+        assert texts == expected, (texts, expected)
+
+    def test_icefall_transducer_model_optimize_nn_model_int8(self):
+        nn_model = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/exp/cpu_jit.pt"
+        tokens = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/data/lang_bpe_500/tokens.txt"
+        wave1 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1089-134686-0001.wav"
+        wave2 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1221-135766-0001.wav"
+
+        if not Path(nn_model).is_file():
+            print(
+                "skipping test_icefall_transducer_model_optimize_nn_model_int8()"
+            )
+            return
+
+        print()
+        print("test_icefall_transducer_model_optimize_nn_model_int8()")
+
+        feat_config = sherpa.FeatureConfig()
+
+        feat_config.fbank_opts.frame_opts.samp_freq = 16000
+        feat_config.fbank_opts.mel_opts.num_bins = 80
+        feat_config.fbank_opts.frame_opts.dither = 0
+
+        def decode(model):
+            config = sherpa.OfflineRecognizerConfig(
+                nn_model=model,
+                tokens=tokens,
+                use_gpu=False,
+                feat_config=feat_config,
+            )
+
+            recognizer = sherpa.OfflineRecognizer(config)
+
+            s1 = recognizer.create_stream()
+            s2 = recognizer.create_stream()
+
+            s1.accept_wave_file(wave1)
+            s2.accept_wave_file(wave2)
+
+            recognizer.decode_streams([s1, s2])
+            print(s1.result)
+            print(s2.result)
+
+            return [s1.result.text, s2.result.text]
+
+        expected = decode(nn_model)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = f"{tmp_dir}/int8.pt"
+            quantized = offline_transducer_asr.optimize_nn_model(
+                nn_model, filename=filename, use_gpu=False, int8=True
+            )
+            assert quantized == filename, quantized
+
+            # It also checks that sherpa can use encoder_proj and
+            # decoder_proj of the quantized joiner
+            texts = decode(quantized)
+
+        for hyp, ref in zip(texts, expected):
+            wer = word_error_rate(hyp, ref)
+            print(f"WER: {wer:.3f}")
+            # int8 may change a few words but not the whole transcript
+            assert wer <= 0.1, (hyp, ref, wer)
+
+    def test_icefall_transducer_model_accept_features(self):
+        nn_model = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/exp/cpu_jit.pt"
+        tokens = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/data/lang_bpe_500/tokens.txt"
+        wave1 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1089-134686-0001.wav"
+        wave2 = f"{d}/icefall-asr-librispeech-pruned-transducer-stateless8-2022-11-14/test_wavs/1221-135766-0001.wav"
+
+        if not Path(nn_model).is_file():
+            print("skipping test_icefall_transducer_model_accept_features()")
+            return
+
+        print()
+        print("test_icefall_transducer_model_accept_features()")
+
+        feat_config = sherpa.FeatureConfig()
+
+        feat_config.fbank_opts.frame_opts.samp_freq = 16000
+        feat_config.fbank_opts.mel_opts.num_bins = 80
+        feat_config.fbank_opts.frame_opts.dither = 0
+
+        config = sherpa.OfflineRecognizerConfig(
+            nn_model=nn_model,
+            tokens=tokens,
+            use_gpu=False,
+            feat_config=feat_config,
+        )
+
+        recognizer = sherpa.OfflineRecognizer(config)
+
+        s1 = recognizer.create_stream()
+        s2 = recognizer.create_stream()
+
+        s1.accept_wave_file(wave1)
+        s2.accept_wave_file(wave2)
+
+        recognizer.decode_streams([s1, s2])
+
+        fbank = kaldifeat.Fbank(feat_config.fbank_opts)
+        waves = [torchaudio.load(w)[0][0] for w in (wave1, wave2)]
+        features = fbank(waves)
+
+        f1 = recognizer.create_stream()
+        f2 = recognizer.create_stream()
+
+        f1.accept_features(features[0])
+        f2.accept_features(features[1])
+
+        recognizer.decode_streams([f1, f2])
+        print(f1.result)
+        print(f2.result)
+
+        assert f1.result.text == s1.result.text, (f1.result, s1.result)
+        assert f2.result.text == s2.result.text, (f2.result, s2.result)
+
+    def test_read_first_channel_multi_channel(self):
+        if offline_transducer_asr.sf is None:
+            print("skipping test_read_first_channel_multi_channel()")
+            return
+
+        print()
+        print("test_read_first_channel_multi_channel()")
+
+        sf = offline_transducer_asr.sf
+
+        # More frames than the block size so that several blocks are read
+        num_frames = 65536 * 2 + 1000
+        samples = torch.rand(num_frames, 2) * 2 - 1
+        samples[:, 1] = -samples[:, 0]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = f"{tmp_dir}/stereo.wav"
+            sf.write(filename, samples.numpy(), 16000, subtype="PCM_16")
+
+            wave, sample_rate = offline_transducer_asr.read_first_channel(
+                filename
+            )
+            expected, expected_sample_rate = torchaudio.load(filename)
+
+        assert sample_rate == expected_sample_rate == 16000, sample_rate
+        assert wave.shape == (num_frames,), wave.shape
+        assert torch.allclose(wave, expected[0], atol=1e-6), (
+            wave - expected[0]
+        ).abs().max()
+
 
 if __name__ == "__main__":
     unittest.main()